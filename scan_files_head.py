@@ -9,22 +9,37 @@
 - Поддерживаемые расширения: .csv, .xls, .xlsx (регистронезависимо).
 - В каждой папке/подпапке берём не более MaxFilesPerFolder файлов,
   сортируем по дате изменения (новые сверху), затем читаем первые N строк.
-- CSV-файлы читаются с авто-детектом кодировки (BOM → charset-normalizer → chardet → fallback).
+- Файлы читаются параллельно в пуле процессов, CSV пишется из главного процесса.
+- xlsx/xls читаются через python-calamine (fallback: потоковый разбор xlsx
+  через zipfile + iterparse, затем openpyxl / xlrd).
+  Пустые и слишком большие (MAX_EXCEL_BYTES) книги не открываются — в строку пишется пометка.
+- CSV-файлы читаются с авто-детектом кодировки (BOM → ASCII → cchardet → charset-normalizer → chardet → fallback).
 - Итог: CSV (ANSI cp1251), разделитель ';'.
   Колонки: File Path; Line 1; ...; Line N (N — максимум среди путей из настроек).
 - Прогресс-бар через tqdm.
 
 Зависимости:
-  pip install openpyxl tqdm xlrd charset-normalizer chardet
+  pip install openpyxl tqdm python-calamine xlrd faust-cchardet charset-normalizer chardet
 """
 
+import io
 import os
 import sys
 import csv
+import re
+import codecs
+import heapq
+import functools
+import zipfile
+import posixpath
 import traceback
-from datetime import datetime
-from pathlib import Path
-from typing import List, Tuple
+import multiprocessing
+import xml.etree.ElementTree as ET
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from itertools import chain
+from operator import itemgetter
+from typing import Dict, List, Tuple
 
 # ---------- Константы и параметры ----------
 
@@ -34,12 +49,35 @@ SETTINGS_SHEET = "Settings"
 DEFAULT_MAX_FILES_PER_FOLDER = 100
 DEFAULT_LINES_PER_FILE = 5
 
-ALLOWED_EXTS = {".csv", ".xls", ".xlsx"}
+ALLOWED_EXTS_NODOT = frozenset({"csv", "xls", "xlsx"})
 
 # Сортировка файлов перед отсечением лимита
 SORT_BY = "modified"   # 'modified' | 'created' | 'accessed'
 SORT_DESC = True       # True — новые сверху
 
+# Параллельное чтение файлов (процессы; на Windows не более 61), файлы идут пачками
+MAX_WORKERS = min(61, os.cpu_count() or 1)
+WORKER_CHUNKSIZE = 16
+# Потоки в каждом процессе, заранее читающие начало CSV из пачки
+PREFETCH_THREADS = 8
+
+# Буфер записи итогового CSV (меньше системных вызовов WriteFile)
+OUTPUT_BUFFER_SIZE = 1 << 20
+# Строки итогового CSV копятся и пишутся пачкой
+OUTPUT_BATCH_ROWS = 10000
+# Windows: '/' → '\' в путях итогового CSV (таблица для str.translate)
+_WIN_SLASH = str.maketrans({"/": "\\"}) if os.name == "nt" else None
+
+# xlsx/xls крупнее этого не разбираются — в строку пишется пометка (защита от многоминутных зависаний)
+MAX_EXCEL_BYTES = 200 * 1024 * 1024
+
+# Начало CSV читается с диска один раз: из него и кодировка, и первые N строк
+CSV_HEAD_BYTES = 64 * 1024
+
+# Автодетект кодировки CSV: сколько байт анализировать и минимальная уверенность cchardet
+ENC_SAMPLE_BYTES = 16 * 1024
+CCHARDET_MIN_CONFIDENCE = 0.5
+
 # ---------- tqdm (прогресс-бар) ----------
 
 try:
@@ -47,13 +85,28 @@ try:
 except Exception:
     tqdm = None
 
+# ---------- cchardet (быстрый детектор кодировки) ----------
+
+try:
+    import cchardet  # type: ignore  # пакет faust-cchardet
+except Exception:
+    cchardet = None
+
+# ---------- python-calamine (быстрое чтение xlsx/xls) ----------
+
+try:
+    from python_calamine import CalamineWorkbook  # type: ignore
+except Exception:
+    CalamineWorkbook = None
+
 # ---------- Вспомогательные функции ----------
 
-def get_app_dir() -> Path:
-    """Папка, где находится .py/.exe."""
+@functools.cache
+def get_app_dir() -> str:
+    """Папка, где находится .py/.exe (вычисляется один раз)."""
     if getattr(sys, "frozen", False):  # PyInstaller
-        return Path(sys.executable).resolve().parent
-    return Path(__file__).resolve().parent
+        return os.path.dirname(os.path.realpath(sys.executable))
+    return os.path.dirname(os.path.realpath(__file__))
 
 
 def require_openpyxl() -> bool:
@@ -74,7 +127,7 @@ def try_import_xlrd() -> bool:
         return False
 
 
-def create_settings_file(path_to_file: Path):
+def create_settings_file(path_to_file: str):
     """Создать настройки с дефолтами и завершить работу."""
     if not require_openpyxl():
         sys.exit(1)
@@ -109,7 +162,7 @@ def create_settings_file(path_to_file: Path):
     sys.exit(0)
 
 
-def read_settings(app_dir: Path) -> Tuple[List[Tuple[str, int, int]], int]:
+def read_settings(app_dir: str) -> Tuple[List[Tuple[str, int, int]], int]:
     """
     Считать настройки.
     Возвращает:
@@ -117,8 +170,8 @@ def read_settings(app_dir: Path) -> Tuple[List[Tuple[str, int, int]], int]:
       - глобальный максимум lines_per_file (для формирования заголовка CSV)
     Если путей нет — используем app_dir с дефолтами.
     """
-    settings_path = app_dir / SETTINGS_FILE
-    if not settings_path.exists():
+    settings_path = os.path.join(app_dir, SETTINGS_FILE)
+    if not os.path.exists(settings_path):
         create_settings_file(settings_path)
 
     if not require_openpyxl():
@@ -181,12 +234,18 @@ def read_settings(app_dir: Path) -> Tuple[List[Tuple[str, int, int]], int]:
 
     if not roots:
         print("В настройках нет корректных путей. Будет просканирована папка приложения.")
-        roots = [(str(app_dir), DEFAULT_MAX_FILES_PER_FOLDER, DEFAULT_LINES_PER_FILE)]
+        roots = [(app_dir, DEFAULT_MAX_FILES_PER_FOLDER, DEFAULT_LINES_PER_FILE)]
         max_lines_global = DEFAULT_LINES_PER_FILE
 
     return roots, max_lines_global
 
 
+def file_ext(name: str) -> str:
+    """Расширение без точки в нижнем регистре ('' если нет) — как Path.suffix, но без pathlib."""
+    dot = name.rfind(".")
+    return name[dot + 1:].lower() if dot > 0 else ""
+
+
 def get_sort_key(stats: os.stat_result) -> float:
     if SORT_BY == "created":
         return float(stats.st_ctime)
@@ -197,18 +256,44 @@ def get_sort_key(stats: os.stat_result) -> float:
 
 # ---------- Автодетект кодировки CSV ----------
 
-def detect_encoding(path: str) -> str | None:
+def _head_end(data: bytes, n: int) -> int:
+    """
+    Смещение конца n-й строки в буфере (сразу после n-го перевода строки) или len(data).
+    Поиск через bytes.find (memchr), без цикла по байтам в Python.
+    """
+    pos = -1
+    for _ in range(n):
+        pos = data.find(b"\n", pos + 1)
+        if pos < 0:
+            return len(data)
+    return pos + 1
+
+
+def detect_encoding(path: str, n: int | None = None) -> Tuple[str | None, bytes | None]:
     """
     Определить кодировку по первым байтам.
-    Приоритет: BOM → charset-normalizer → chardet → None.
-    Возвращает строку кодировки или None.
+    Приоритет: BOM → ASCII → cchardet → charset-normalizer → chardet → None.
+    n — сколько строк будет прочитано: для проверки на ASCII достаточно их.
+    Возвращает (кодировка или None, прочитанное начало файла или None при ошибке чтения).
     """
+    prefix = read_head(path)
+    if prefix is None:
+        return None, None
+    return _detect_encoding_bytes(prefix, n), prefix
+
+
+def read_head(path: str) -> bytes | None:
+    """Первые CSV_HEAD_BYTES байт файла или None при ошибке чтения."""
     try:
         with open(path, "rb") as bf:
-            data = bf.read(256 * 1024)  # до 256 КБ для анализа
+            return bf.read(CSV_HEAD_BYTES)
     except Exception:
         return None
 
+
+def _detect_encoding_bytes(data: bytes, n: int | None) -> str | None:
+    """Кодировка по уже прочитанному началу файла (см. detect_encoding)."""
+
     # BOM
     if data.startswith(b"\xef\xbb\xbf"):
         return "utf-8-sig"
@@ -217,6 +302,27 @@ def detect_encoding(path: str) -> str | None:
     if data.startswith(b"\xff\xfe") or data.startswith(b"\xfe\xff"):
         return "utf-16"
 
+    # чистый ASCII в читаемых строках -> безопасно читать как utf-8, детекторы не нужны
+    # (bytes.isascii проверяет старший бит сразу по машинному слову).
+    # NUL тоже ASCII, но в тексте он почти всегда означает utf-16/32 без BOM.
+    head = data if n is None else data[:_head_end(data, n)]
+    if head.isascii() and b"\x00" not in head:
+        return "utf-8"
+
+    data = data[:ENC_SAMPLE_BYTES]  # детекторам хватает первых КБ
+
+    # cchardet (utf-16/32 без BOM не распознаёт — при NUL сразу к charset-normalizer)
+    if cchardet is not None and b"\x00" not in data:
+        try:
+            guess = cchardet.detect(data)
+            enc = guess.get("encoding")
+            if enc and (guess.get("confidence") or 0) >= CCHARDET_MIN_CONFIDENCE:
+                if enc.lower() == "ascii":
+                    return "utf-8"
+                return enc
+        except Exception:
+            pass
+
     # charset-normalizer
     try:
         from charset_normalizer import from_bytes  # type: ignore
@@ -247,12 +353,47 @@ def detect_encoding(path: str) -> str | None:
     return None
 
 
-def read_csv_first_lines(path: str, n: int) -> List[str]:
+def _first_lines_from_bytes(data: bytes, encoding: str, n: int) -> List[str] | None:
+    """
+    Первые n строк из уже прочитанного начала файла (strict, как при чтении с диска).
+    Декодируется только кусок до n-го перевода строки; в utf-16/32 перевод строки
+    занимает несколько байт и по одиночному b"\n" не ищется, поэтому там
+    декодируется весь буфер, а строки отсчитываются уже в тексте.
+    None — если целых n строк в буфере нет, а файл длиннее буфера, или кусок
+    не декодируется (тогда решает чтение с диска).
+    """
+    if codecs.lookup(encoding).name.startswith(("utf-16", "utf-32")):
+        end = len(data)
+    else:
+        end = _head_end(data, n)
+    at_eof = len(data) < CSV_HEAD_BYTES and end == len(data)  # весь файл в буфере
+    try:
+        # у конца файла обрезанный символ — ошибка, как при чтении с диска
+        text = codecs.getincrementaldecoder(encoding)(errors="strict").decode(data[:end], final=at_eof)
+    except UnicodeDecodeError:
+        return None
+    lines = []
+    for line in io.StringIO(text, newline=""):
+        if len(lines) >= n:
+            break
+        lines.append(line)
+    if not at_eof and (len(lines) < n or not lines[-1].endswith(("\r", "\n"))):
+        return None
+    return [line.rstrip("\r\n") for line in lines]
+
+
+def read_csv_first_lines(path: str, n: int, prefix: bytes | None = None) -> List[str]:
     """
     Прочитать первые n строк CSV как обычный текст с авто-детектом кодировки.
+    prefix — уже прочитанное начало файла (read_head); без него оно читается здесь.
+    Строки берутся из этого начала; с диска файл перечитывается,
+    только если n строк в него не поместились.
     Возвращает список строк без переводов строк.
     """
-    enc = detect_encoding(path)
+    if prefix is None:
+        enc, prefix = detect_encoding(path, n=n)
+    else:
+        enc = _detect_encoding_bytes(prefix, n)
     # Порядок попыток: определённая → типичные
     candidates = []
     if enc:
@@ -261,12 +402,14 @@ def read_csv_first_lines(path: str, n: int) -> List[str]:
 
     for encoding in candidates:
         try:
-            lines = []
-            with open(path, "r", encoding=encoding, errors="strict", newline="") as f:
-                for i, line in enumerate(f):
-                    if i >= n:
-                        break
-                    lines.append(line.rstrip("\r\n"))
+            lines = None if prefix is None else _first_lines_from_bytes(prefix, encoding, n)
+            if lines is None:
+                lines = []
+                with open(path, "r", encoding=encoding, errors="strict", newline="") as f:
+                    for i, line in enumerate(f):
+                        if i >= n:
+                            break
+                        lines.append(line.rstrip("\r\n"))
             return lines
         except Exception:
             continue
@@ -284,9 +427,227 @@ def read_csv_first_lines(path: str, n: int) -> List[str]:
         return ["<не удалось прочитать CSV>"]
 
 
+def _excel_cell_to_str(v) -> str:
+    """Значение ячейки calamine → строка в том же виде, что давал openpyxl."""
+    if v is None:
+        return ""
+    if isinstance(v, float) and v.is_integer() and abs(v) < 1e16:
+        return str(int(v))  # calamine отдаёт целые как float; от 1e16 str даёт 1e+16, как openpyxl
+    if isinstance(v, date) and not isinstance(v, datetime):
+        return str(datetime(v.year, v.month, v.day))
+    return str(v)
+
+
+def read_calamine_first_rows(path: str, n: int) -> List[str]:
+    """Первые n строк из .xlsx/.xls (первый лист) через python-calamine."""
+    with CalamineWorkbook.from_path(path) as wb:
+        sheet = wb.get_sheet_by_index(0)
+        rows = sheet.to_python(skip_empty_area=False, nrows=n)
+    out = ["\t".join(_excel_cell_to_str(v) for v in row).rstrip() for row in rows]
+    if not out:
+        out = ["" for _ in range(n)]
+    return out
+
+
+# ---------- Потоковое чтение .xlsx (zipfile + iterparse) ----------
+
+_XLSX_NS = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_XLSX_REL_ID = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id"
+
+# Встроенные форматы дат (как в openpyxl); 46 — "[h]:mm:ss", длительность
+_XLSX_DATE_FMT_IDS = {14, 15, 16, 17, 18, 19, 20, 21, 22, 45, 46, 47}
+_XLSX_TIMEDELTA_FMT_IDS = {46}
+_XLSX_FMT_STRIP_RE = re.compile(r'\[(?!(hh?|mm?|ss?)\])[^\]]*\]|"[^"]*"')
+_XLSX_DATE_FMT_RE = re.compile(r"(?<![_\\])[dmhysDMHYS]")
+_XLSX_TIMEDELTA_RE = re.compile(r"\[hh?\](:mm(:ss(\.0*)?)?)?|\[mm?\](:ss(\.0*)?)?|\[ss?\](\.0*)?", re.I)
+
+
+def _xlsx_first_sheet(zf: zipfile.ZipFile) -> Tuple[str, bool]:
+    """Путь к первому листу внутри архива и признак эпохи 1904."""
+    wb = ET.fromstring(zf.read("xl/workbook.xml"))
+    pr = wb.find(f"{_XLSX_NS}workbookPr")
+    date1904 = pr is not None and pr.get("date1904") in ("1", "true")
+    rid = wb.find(f"{_XLSX_NS}sheets/{_XLSX_NS}sheet").get(_XLSX_REL_ID)
+    rels = ET.fromstring(zf.read("xl/_rels/workbook.xml.rels"))
+    for rel in rels:
+        if rel.get("Id") == rid:
+            target = rel.get("Target")
+            if target.startswith("/"):
+                return target[1:], date1904
+            return posixpath.normpath(posixpath.join("xl", target)), date1904
+    raise KeyError(f"лист {rid} не найден в workbook.xml.rels")
+
+
+def _xlsx_date_styles(zf: zipfile.ZipFile) -> Tuple[set, set]:
+    """Номера стилей ячеек (атрибут s) с форматом даты и с форматом длительности."""
+    try:
+        root = ET.fromstring(zf.read("xl/styles.xml"))
+    except KeyError:
+        return set(), set()
+    custom = {int(f.get("numFmtId")): f.get("formatCode") or "" for f in root.iter(f"{_XLSX_NS}numFmt")}
+    dates, deltas = set(), set()
+    xfs = root.find(f"{_XLSX_NS}cellXfs")
+    for i, xf in enumerate([] if xfs is None else xfs.findall(f"{_XLSX_NS}xf")):
+        fmt_id = int(xf.get("numFmtId", 0))
+        if fmt_id in custom:
+            code = custom[fmt_id].split(";")[0]
+            if _XLSX_DATE_FMT_RE.search(_XLSX_FMT_STRIP_RE.sub("", code)):
+                dates.add(i)
+            if _XLSX_TIMEDELTA_RE.search(code):
+                deltas.add(i)
+        elif fmt_id in _XLSX_DATE_FMT_IDS:
+            dates.add(i)
+            if fmt_id in _XLSX_TIMEDELTA_FMT_IDS:
+                deltas.add(i)
+    return dates, deltas
+
+
+def _xlsx_from_serial(value: float, date1904: bool, as_timedelta: bool):
+    """Серийное число Excel → datetime / time / timedelta (как openpyxl.from_excel)."""
+    if as_timedelta:
+        td = timedelta(days=value)
+        if td.microseconds:
+            td = timedelta(seconds=td.total_seconds() // 1, microseconds=round(td.microseconds, -3))
+        return td
+    day, fraction = divmod(value, 1)
+    diff = timedelta(milliseconds=round(fraction * 86400 * 1000))
+    if 0 <= value < 1 and diff.days == 0:
+        return (datetime.min + diff).time()
+    if 0 < value < 60 and not date1904:
+        day += 1  # фиктивное 29.02.1900 в Excel
+    epoch = datetime(1904, 1, 1) if date1904 else datetime(1899, 12, 30)
+    return epoch + timedelta(days=day) + diff
+
+
+def _xlsx_text(el) -> str:
+    """Текст <si>/<is>: простой <t> или фрагменты <r><t>, без фонетики <rPh>."""
+    parts = []
+    for child in el:
+        if child.tag == f"{_XLSX_NS}t":
+            parts.append(child.text or "")
+        elif child.tag == f"{_XLSX_NS}r":
+            parts.append(child.findtext(f"{_XLSX_NS}t") or "")
+    return "".join(parts)
+
+
+def _xlsx_col_index(ref: str) -> int:
+    """Номер столбца (с 1) из ссылки на ячейку, например 'AB12' → 28."""
+    col = 0
+    for ch in ref:
+        if ch.isdigit():
+            break
+        col = col * 26 + ord(ch.upper()) - 64
+    return col
+
+
+def _xlsx_shared_strings(zf: zipfile.ZipFile, needed: set) -> Dict[int, str]:
+    """Достать из sharedStrings.xml только строки с нужными индексами."""
+    out = {}
+    last = max(needed)
+    with zf.open("xl/sharedStrings.xml") as f:
+        idx = 0
+        for _event, el in ET.iterparse(f):
+            if el.tag != f"{_XLSX_NS}si":
+                continue
+            if idx in needed:
+                out[idx] = _xlsx_text(el)
+            el.clear()
+            if idx >= last:
+                break
+            idx += 1
+    return out
+
+
+def read_xlsx_stream_first_rows(path: str, n: int) -> List[str]:
+    """
+    Первые n строк из .xlsx (первый лист) без openpyxl: zipfile + iterparse.
+    Разбор XML листа останавливается после n-й строки, из sharedStrings.xml
+    берутся только нужные индексы.
+    """
+    rows: List[Dict[int, str]] = []
+    shared = []  # (ячейки строки, столбец, индекс общей строки)
+    with zipfile.ZipFile(path) as zf:
+        sheet_path, date1904 = _xlsx_first_sheet(zf)
+        dates, deltas = _xlsx_date_styles(zf)
+
+        with zf.open(sheet_path) as f:
+            row_idx = 0
+            for _event, el in ET.iterparse(f):
+                if el.tag != f"{_XLSX_NS}row":
+                    continue
+                r = el.get("r")
+                row_idx = int(r) if r else row_idx + 1
+                # пропущенные строки (и хвост до n, если лист идёт дальше) — пустые
+                while len(rows) < min(row_idx, n):
+                    rows.append({})
+                if row_idx > n:
+                    break
+                cells = rows[row_idx - 1]
+
+                col = 0
+                for c in el.iter(f"{_XLSX_NS}c"):
+                    ref = c.get("r")
+                    col = _xlsx_col_index(ref) if ref else col + 1
+                    t = c.get("t", "n")
+                    if t == "inlineStr":
+                        inline = c.find(f"{_XLSX_NS}is")
+                        cells[col] = "" if inline is None else _xlsx_text(inline)
+                        continue
+                    v = c.findtext(f"{_XLSX_NS}v")
+                    if not v:
+                        continue
+                    if t == "s":
+                        shared.append((cells, col, int(v)))
+                    elif t == "b":
+                        cells[col] = str(bool(int(v)))
+                    elif t == "d":
+                        try:
+                            cells[col] = str(datetime.fromisoformat(v))
+                        except ValueError:
+                            cells[col] = v
+                    elif t == "n":
+                        value = float(v) if ("." in v or "E" in v or "e" in v) else int(v)
+                        style = int(c.get("s", 0))
+                        if style in dates:
+                            try:
+                                value = _xlsx_from_serial(value, date1904, style in deltas)
+                            except (OverflowError, ValueError):
+                                pass
+                        cells[col] = str(value)
+                    else:  # str, e
+                        cells[col] = v
+                el.clear()
+                if row_idx == n:
+                    break
+
+        if shared:
+            strings = _xlsx_shared_strings(zf, {idx for _cells, _col, idx in shared})
+            for cells, col, idx in shared:
+                cells[col] = strings.get(idx, "")
+
+    out = []
+    for cells in rows:
+        width = max(cells) if cells else 0
+        out.append("\t".join(cells.get(i, "") for i in range(1, width + 1)).rstrip())
+    if not out:
+        out = ["" for _ in range(n)]
+    return out
+
+
 def read_xlsx_first_rows(path: str, n: int) -> List[str]:
-    """Первые n строк из .xlsx (первый лист)."""
+    """
+    Первые n строк из .xlsx (первый лист).
+    python-calamine → потоковый разбор zip/xml → openpyxl.
+    """
     try:
+        if CalamineWorkbook is not None:
+            return read_calamine_first_rows(path, n)
+        try:
+            return read_xlsx_stream_first_rows(path, n)
+        except zipfile.BadZipFile:
+            raise
+        except Exception:
+            pass  # нестандартная структура пакета — разбирает openpyxl
         import openpyxl
         wb = openpyxl.load_workbook(path, data_only=True, read_only=True)
         ws = wb.worksheets[0]
@@ -302,10 +663,16 @@ def read_xlsx_first_rows(path: str, n: int) -> List[str]:
 
 
 def read_xls_first_rows(path: str, n: int) -> List[str]:
-    """Первые n строк из .xls (первый лист). Требуется xlrd."""
-    if not try_import_xlrd():
-        return ["<xlrd не установлен. Установите: pip install xlrd>"]
+    """
+    Первые n строк из .xls (первый лист). python-calamine, иначе xlrd.
+    Через calamine числа и даты выводятся как в .xlsx (3, 2024-01-02 00:00:00),
+    через xlrd — как раньше (3.0, серийные номера дат).
+    """
+    if CalamineWorkbook is None and not try_import_xlrd():
+        return ["<xlrd не установлен. Установите: pip install python-calamine или xlrd>"]
     try:
+        if CalamineWorkbook is not None:
+            return read_calamine_first_rows(path, n)
         import xlrd
         book = xlrd.open_workbook(path)
         sheet = book.sheet_by_index(0)
@@ -321,115 +688,217 @@ def read_xls_first_rows(path: str, n: int) -> List[str]:
         return [f"<xls ошибка: {e}>"]
 
 
-def get_first_lines_for_file(path: str, n: int) -> List[str]:
-    ext = Path(path).suffix.lower()
-    if ext == ".csv":
-        return read_csv_first_lines(path, n)
-    elif ext == ".xlsx":
-        return read_xlsx_first_rows(path, n)
-    elif ext == ".xls":
-        return read_xls_first_rows(path, n)
-    return ["<неподдерживаемое расширение>"]
-
-
-def count_expected_files(roots_cfg: List[Tuple[str, int, int]]) -> int:
-    """Подсчитать ожидаемое количество файлов (с учётом расширений и лимита на папку)."""
-    total = 0
-    for base, per_folder_limit, _lines in roots_cfg:
-        for root, _dirs, files in os.walk(base, topdown=True, onerror=None, followlinks=False):
-            candidates = [f for f in files if Path(f).suffix.lower() in ALLOWED_EXTS]
-            # сортировка по дате
-            try:
-                items = []
-                for name in candidates:
-                    fp = os.path.join(root, name)
+# Чтение по расширению (без точки)
+_READERS = {
+    "csv": read_csv_first_lines,
+    "xlsx": read_xlsx_first_rows,
+    "xls": read_xls_first_rows,
+}
+
+
+def get_first_lines_for_file(path: str, n: int, size: int | None = None) -> List[str]:
+    """
+    Первые n строк файла по его расширению.
+    size — размер из обхода папок: пустые и слишком большие xlsx/xls не открываются.
+    """
+    ext = file_ext(path)
+    reader = _READERS.get(ext)
+    if reader is None:
+        return ["<неподдерживаемое расширение>"]
+    if size is not None and ext != "csv":
+        if size == 0:
+            return [f"<{ext}: пустой файл>"]
+        if size > MAX_EXCEL_BYTES:
+            return [f"<{ext} слишком большой: {size} байт>"]
+    return reader(path, n)
+
+
+def walk_files(base: str):
+    """
+    Обход дерева через os.scandir (сверху вниз, как os.walk).
+    Для каждой папки выдаёт (путь_папки, [DirEntry файлов с нужными расширениями]).
+    Ссылки на папки не раскрываются, недоступные папки пропускаются.
+    """
+    stack = [base]
+    while stack:
+        root = stack.pop()
+        files = []
+        subdirs = []
+        try:
+            with os.scandir(root) as it:
+                for entry in it:
                     try:
-                        st = os.stat(fp)
-                        items.append((name, get_sort_key(st)))
-                    except Exception:
-                        pass
-                items.sort(key=lambda t: t[1], reverse=SORT_DESC)
-                count_here = len(items) if per_folder_limit <= 0 else min(per_folder_limit, len(items))
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.path)
+                        elif file_ext(entry.name) in ALLOWED_EXTS_NODOT and entry.is_file():
+                            files.append(entry)
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+        yield root, files
+        stack.extend(reversed(subdirs))
+
+
+def iter_work_items(roots_cfg: List[Tuple[str, int, int]]):
+    """
+    Обойти папки и выдать задания (fp, lines_per_file, размер_файла):
+    в каждой папке — сортировка по дате и отсечение по лимиту.
+    """
+    for base, per_folder_limit, lines_per_file in roots_cfg:
+        for _root, entries in walk_files(base):
+            # собираем статы для сортировки (DirEntry.stat кэширует результат scandir)
+            items = []
+            for entry in entries:
+                try:
+                    st = entry.stat()
+                except Exception:
+                    continue
+                items.append((entry.path, get_sort_key(st), st.st_size))
+
+            # сортируем и режем: при лимите — частичный отбор через heapq (O(n log k)),
+            # ключ — itemgetter без вызова Python-функции на каждый элемент
+            try:
+                if 0 < per_folder_limit < len(items):
+                    select = heapq.nlargest if SORT_DESC else heapq.nsmallest
+                    items = select(per_folder_limit, items, key=itemgetter(1))
+                else:
+                    items.sort(key=itemgetter(1), reverse=SORT_DESC)
             except Exception:
-                count_here = len(candidates) if per_folder_limit <= 0 else min(per_folder_limit, len(candidates))
-            total += count_here
-    return total
+                pass
+
+            if per_folder_limit > 0 and len(items) > per_folder_limit:
+                items = items[:per_folder_limit]
+
+            for fp, _k, size in items:
+                yield fp, lines_per_file, size
 
 
-def scan_and_dump(roots_cfg: List[Tuple[str, int, int]], out_dir: Path, global_lines_max: int) -> Path:
+def _worker(item: Tuple[str, int, int], prefix: bytes | None = None) -> Tuple[str, List[str] | None]:
+    """
+    Задание для пула процессов: (fp, n, size) → (fp, строки) или (fp, None) при ошибке.
+    prefix — заранее прочитанное начало CSV.
+    """
+    fp, n, size = item
+    try:
+        if prefix is not None:
+            return fp, read_csv_first_lines(fp, n, prefix)
+        return fp, get_first_lines_for_file(fp, n, size)
+    except Exception:
+        return fp, None
+
+
+_PREFETCH_POOL: ThreadPoolExecutor | None = None
+
+
+def _prefetch_pool() -> ThreadPoolExecutor:
+    """Пул потоков упреждающего чтения (свой в каждом процессе, создаётся лениво)."""
+    global _PREFETCH_POOL
+    if _PREFETCH_POOL is None:
+        _PREFETCH_POOL = ThreadPoolExecutor(max_workers=PREFETCH_THREADS)
+    return _PREFETCH_POOL
+
+
+def _worker_batch(batch: List[Tuple[str, int, int]]) -> List[Tuple[str, List[str] | None]]:
+    """
+    Пачка заданий для пула процессов. Начала всех CSV пачки читаются
+    потоками заранее: пока разбирается один файл, следующие уже читаются с диска.
+    """
+    pool = _prefetch_pool()
+    heads = {fp: pool.submit(read_head, fp) for fp, _n, _size in batch if file_ext(fp) == "csv"}
+    out = []
+    for item in batch:
+        fut = heads.get(item[0])
+        out.append(_worker(item, None if fut is None else fut.result()))
+    return out
+
+
+def make_row_formatter(n_lines: int):
+    """
+    Собрать форматтер строк итогового CSV под фиксированное число колонок:
+    File Path; Line 1..n_lines (строки дополняются/обрезаются до n_lines).
+    Поля без ';', '"' и переводов строк склеиваются одним ';'.join,
+    остальное форматирует csv.writer (QUOTE_MINIMAL) — результат тот же.
+    """
+    pad = [""] * n_lines
+    buf = io.StringIO()
+    writer = csv.writer(buf, delimiter=";", quoting=csv.QUOTE_MINIMAL, lineterminator="\n")
+
+    def format_row(file_path: str, lines: List[str]) -> str:
+        k = len(lines)
+        if k < n_lines:
+            lines = lines + pad[k:]
+        elif k > n_lines:
+            lines = lines[:n_lines]
+        row = file_path + ";" + ";".join(lines)
+        if row.count(";") == n_lines and '"' not in row and "\n" not in row and "\r" not in row:
+            return row + "\n"
+        buf.seek(0)
+        buf.truncate()
+        writer.writerow([file_path, *lines])
+        return buf.getvalue()
+
+    return format_row
+
+
+def scan_and_dump(roots_cfg: List[Tuple[str, int, int]], out_dir: str, global_lines_max: int) -> str:
     """
     Сканируем и записываем CSV.
     Первая колонка: полный путь к файлу с именем и расширением.
     Далее: Line 1..Line N (N = global_lines_max).
     """
-    out_dir.mkdir(parents=True, exist_ok=True)
-    out_csv = out_dir / f"Files_Head_Scan_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    os.makedirs(out_dir, exist_ok=True)
+    out_csv = os.path.join(out_dir, f"Files_Head_Scan_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv")
 
-    headers = ["File Path"] + [f"Line {i}" for i in range(1, global_lines_max + 1)]
+    format_row = make_row_formatter(global_lines_max)
 
     total_written = 0
     skipped = 0
 
+    # один проход по дереву: список заданий заодно даёт total для прогресс-бара
+    work_items = list(iter_work_items(roots_cfg))
+
     bar = None
     if tqdm is not None:
         try:
-            expected = count_expected_files(roots_cfg)
-            bar = tqdm(total=expected, unit="file", ascii=True, dynamic_ncols=True, leave=False)
+            bar = tqdm(total=len(work_items), unit="file", ascii=True, dynamic_ncols=True, leave=False)
         except Exception:
             bar = None
 
-    with open(out_csv, "w", encoding="cp1251", errors="replace", newline="") as f:
-        writer = csv.writer(f, delimiter=";", quoting=csv.QUOTE_MINIMAL, lineterminator="\n")
-        writer.writerow(headers)
+    with open(out_csv, "w", encoding="cp1251", errors="replace", newline="",
+              buffering=OUTPUT_BUFFER_SIZE) as f, \
+            ProcessPoolExecutor(max_workers=MAX_WORKERS) as ex:
+        f.write(format_row("File Path", [f"Line {i}" for i in range(1, global_lines_max + 1)]))
 
-        for base, per_folder_limit, lines_per_file in roots_cfg:
-            for root, _dirs, files in os.walk(base, topdown=True, onerror=None, followlinks=False):
-                # отбираем по расширениям
-                candidates = [name for name in files if Path(name).suffix.lower() in ALLOWED_EXTS]
-
-                # собираем статы для сортировки
-                items = []
-                for name in candidates:
-                    fp = os.path.join(root, name)
+        # файлы читаются в пуле процессов, запись — только в главном процессе
+        batches = [work_items[i:i + WORKER_CHUNKSIZE] for i in range(0, len(work_items), WORKER_CHUNKSIZE)]
+        results = chain.from_iterable(ex.map(_worker_batch, batches))
+        pending_rows = []
+        for fp, lines in results:
+            try:
+                if lines is None:
+                    skipped += 1
+                    continue
+                file_path = fp
+                if _WIN_SLASH is not None:
+                    file_path = file_path.translate(_WIN_SLASH)
+                # длина строки нормализуется до global_lines_max в format_row
+                pending_rows.append(format_row(file_path, lines))
+                total_written += 1
+                if len(pending_rows) >= OUTPUT_BATCH_ROWS:
+                    f.write("".join(pending_rows))
+                    pending_rows.clear()
+            except Exception:
+                skipped += 1
+            finally:
+                if bar is not None:
                     try:
-                        st = os.stat(fp)
+                        bar.update(1)
                     except Exception:
-                        continue
-                    items.append((name, get_sort_key(st)))
-
-                # сортируем и режем
-                try:
-                    items.sort(key=lambda t: t[1], reverse=SORT_DESC)
-                except Exception:
-                    pass
-
-                if per_folder_limit > 0 and len(items) > per_folder_limit:
-                    items = items[:per_folder_limit]
+                        pass
 
-                # обрабатываем файлы
-                for name, _k in items:
-                    fp = os.path.join(root, name)
-                    try:
-                        lines = get_first_lines_for_file(fp, lines_per_file)
-                        # нормализуем длину до global_lines_max
-                        if len(lines) < global_lines_max:
-                            lines = lines + [""] * (global_lines_max - len(lines))
-                        elif len(lines) > global_lines_max:
-                            lines = lines[:global_lines_max]
-
-                        file_path = fp
-                        if os.name == "nt":
-                            file_path = file_path.replace("/", "\\")
-                        writer.writerow([file_path] + lines)
-                        total_written += 1
-                    except Exception:
-                        skipped += 1
-                    finally:
-                        if bar is not None:
-                            try:
-                                bar.update(1)
-                            except Exception:
-                                pass
+        if pending_rows:
+            f.write("".join(pending_rows))
 
     if bar is not None:
         try:
@@ -452,6 +921,7 @@ def main():
 
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # PyInstaller: дочерние процессы пула
     try:
         main()
     except KeyboardInterrupt: